@@ -285,7 +285,9 @@ class Core:
         async def init_db() -> None:
             if not self._db_path.exists():
                 await zbdb.create_database(self._db_path)
-            return await zbdb.create_connection(self._db_path, self._dummy_module, self.eventloop)
+            return await zbdb.create_connection(
+                self._db_path, self._dummy_module, self.eventloop, pragmas=self.config["Database"].get("Pragmas")
+            )
 
         self.database = self.eventloop.run_until_complete(init_db())
 
@@ -942,7 +944,9 @@ class Core:
         if module_id not in self._all_modules:
             raise ModuleNotLoaded(f"Module '{module_id}' is not loaded.", mod_id=module_id)
         module = self._all_modules[module_id]
-        connection = await zbdb.create_connection(self._db_path, module, self.eventloop, readonly)
+        connection = await zbdb.create_connection(
+            self._db_path, module, self.eventloop, readonly, pragmas=self.config["Database"].get("Pragmas")
+        )
         self._db_connections[module_id] = connection
         return connection
 
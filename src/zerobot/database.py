@@ -12,9 +12,10 @@ import logging
 import re
 import sqlite3
 from datetime import datetime, timezone
+from functools import lru_cache
 from importlib import resources
 from pathlib import Path
-from typing import TYPE_CHECKING, AnyStr
+from typing import TYPE_CHECKING, Any, AnyStr
 
 import aiosqlite
 
@@ -25,6 +26,15 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger("ZeroBot.Database")
 
+# Applied to every connection, before any configured PRAGMAs. WAL mode is left
+# opt-in through the [Database.Pragmas] config table, since it persists in the
+# database file and keeps -wal and -shm files next to it; see
+# `create_connection`.
+DEFAULT_PRAGMAS = {"temp_store": "MEMORY"}
+PRAGMA_TOKEN = re.compile(r"-?\w+")
+# RETURNING clauses first shipped with SQLite 3.35
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
 sqlite3.register_converter("BOOLEAN", lambda x: bool(int(x)))
 sqlite3.converters["DATETIME"] = sqlite3.converters["TIMESTAMP"]  # alias
 
@@ -33,15 +43,25 @@ _orig_adapter = sqlite3.adapters[(datetime, sqlite3.PrepareProtocol)]
 sqlite3.adapters[(datetime, sqlite3.PrepareProtocol)] = lambda val: _orig_adapter(val).partition(".")[0]
 
 
+@lru_cache(maxsize=128)
+def compile_regexp(pattern: AnyStr) -> re.Pattern | None:
+    """Compile a pattern for `regexp`, or return `None` if it's invalid."""
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return None
+
+
 # Why does Python not include this?
 def regexp(pattern: AnyStr, string: AnyStr) -> bool:
     """SQLite REGEXP implementation."""
     if pattern is None or string is None:
         return False
-    try:
-        return re.search(pattern, string) is not None
-    except re.error:
+    # Called for every row, so don't go through the `re` module's cache (or
+    # fail to compile a bad pattern) each time.
+    if (compiled := compile_regexp(pattern)) is None:
         return False
+    return compiled.search(string) is not None
 
 
 def collate_casefold(a: str, b: str) -> bool:
@@ -98,6 +118,8 @@ class DBModel:
         name of the class.
     """
 
+    __slots__ = ("_connection",)
+
     table_name = None
 
     def __new__(cls, *args, **kwargs):
@@ -331,6 +353,8 @@ class Participant(DBModel):
     id
     """
 
+    __slots__ = ("id", "name", "user", "user_id")
+
     table_name = "participants"
 
     def __init__(
@@ -359,8 +383,13 @@ class Participant(DBModel):
         return self.user.name if self.user else self.name
 
     def __eq__(self, other):
+        if not isinstance(other, Participant):
+            return NotImplemented
         return self.id == other.id
 
+    def __hash__(self):
+        return hash(self.id)
+
     @classmethod
     def from_row(cls, conn: Connection, row: sqlite3.Row, user: DBUser = None) -> Participant:
         """Construct a `Participant` from a database row.
@@ -432,18 +461,29 @@ class Participant(DBModel):
             The linked user to search for. May be a `DBUser` object or an `int`
             referring to a user ID.
         """
-        try:
-            user_id = user.id
-        except AttributeError:
-            user_id = int(user)
+        if isinstance(user, DBUser):
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT * FROM {cls.table_name} WHERE user_id = ?", (user.id,))
+                row = await cur.fetchone()
+            return cls.from_row(conn, row, user) if row is not None else None
+
+        # Only have an ID, so fetch the user along with the participant
         async with conn.cursor() as cur:
-            await cur.execute(f"SELECT * FROM {cls.table_name} WHERE user_id = ?", (user_id,))
+            await cur.execute(
+                f"""
+                SELECT participant_id, {cls.table_name}.name AS "participant_name",
+                       {DBUser.table_name}.*
+                FROM {cls.table_name}
+                JOIN {DBUser.table_name} USING (user_id)
+                WHERE user_id = ?
+            """,
+                (int(user),),
+            )
             row = await cur.fetchone()
         if row is None:
             return None
-        if not isinstance(user, DBUser):
-            user = await DBUser.from_id(conn, row["user_id"])
-        return cls.from_row(conn, row, user)
+        user = DBUser.from_row(conn, row)
+        return cls(conn, row["participant_id"], row["participant_name"], user_id=user.id, user=user)
 
     async def fetch_user(self) -> DBUser:
         """Fetch the database user linked to this participant.
@@ -467,7 +507,9 @@ class Participant(DBModel):
             """,
                 (self.id, self.name, self.user_id),
             )
-            self.id = cur.lastrowid
+            # Only a new participant gets an ID, so lastrowid is reliable here
+            if self.id is None:
+                self.id = cur.lastrowid
             await self._connection.commit()
 
 
@@ -508,26 +550,46 @@ async def get_participant(conn: Connection, name: str, *, auto_create: bool = Tr
     """
     if not (name := name.strip()):
         raise ValueError("Name is empty or whitespace")
+    # Fetch any linked user along with the participant
     async with conn.cursor() as cur:
         await cur.execute(
-            """
-            SELECT participant_id, name, user_id
+            f"""
+            SELECT participant_id, pan.name AS "participant_name", {DBUser.table_name}.*
             FROM participants_all_names AS "pan"
+            LEFT JOIN {DBUser.table_name} USING (user_id)
             WHERE pan.name = ? COLLATE FOLD
         """,
             (name,),
         )
         row = await cur.fetchone()
-    if not row:
-        if auto_create:
-            participant = Participant(conn, None, name)
-            await participant.save()
+    if row:
+        user = DBUser.from_row(conn, row) if row["user_id"] is not None else None
+        return Participant(conn, row["participant_id"], row["participant_name"], user_id=row["user_id"], user=user)
+    if not auto_create:
+        return None
+    # Create and fetch the new participant in one statement where SQLite
+    # supports it. Either way, a concurrent creation of the same name resolves
+    # to the existing row instead of failing.
+    async with conn.cursor() as cur:
+        if SQLITE_HAS_RETURNING:
+            await cur.execute(
+                f"""
+                INSERT INTO {Participant.table_name} (name) VALUES (?)
+                ON CONFLICT (name) DO UPDATE SET user_id = user_id
+                RETURNING participant_id, name, user_id
+            """,
+                (name,),
+            )
         else:
-            participant = None
-    else:
-        participant = Participant.from_row(conn, row)
-        with contextlib.suppress(ValueError):
-            await participant.fetch_user()
+            await cur.execute(f"INSERT INTO {Participant.table_name} (name) VALUES (?) ON CONFLICT DO NOTHING", (name,))
+            await cur.execute(
+                f"SELECT participant_id, name, user_id FROM {Participant.table_name} WHERE name = ?", (name,)
+            )
+        row = await cur.fetchone()
+    await conn.commit()
+    participant = Participant.from_row(conn, row)
+    with contextlib.suppress(ValueError):
+        await participant.fetch_user()
     return participant
 
 
@@ -546,11 +608,12 @@ async def find_participant(conn: Connection, pattern: str) -> Participant | None
             """
             SELECT participant_id FROM participants_all_names
             WHERE name REGEXP ?
+            LIMIT 1
         """,
             (f"(?i:{pattern})",),
         )
         row = await cur.fetchone()
-    return await Participant.from_id(conn, row[0]) if row else None
+    return await Participant.from_id(conn, row["participant_id"]) if row else None
 
 
 async def get_user(conn: Connection, name: str, *, ignore_case: bool = False) -> DBUser | None:
@@ -588,7 +651,7 @@ async def get_user(conn: Connection, name: str, *, ignore_case: bool = False) ->
             (name,),
         )
         row = await cur.fetchone()
-    return await DBUser.from_id(conn, row[0]) if row else None
+    return await DBUser.from_id(conn, row["user_id"]) if row else None
 
 
 class Source(DBModel):
@@ -692,7 +755,9 @@ class Source(DBModel):
             """,
                 (self.id, self.protocol, self.server, self.channel),
             )
-            self.id = cur.lastrowid
+            # Only a new source gets an ID, so lastrowid is reliable here
+            if self.id is None:
+                self.id = cur.lastrowid
             await self._connection.commit()
 
 
@@ -746,6 +811,7 @@ async def create_connection(
     module: Module,
     loop: asyncio.AbstractEventLoop | None = None,
     readonly: bool = False,
+    pragmas: dict[str, Any] | None = None,
     **kwargs,
 ) -> Connection:
     """Establish a new connection to a ZeroBot database.
@@ -765,6 +831,13 @@ async def create_connection(
         The `asyncio` event loop to use. This is typically `Core.eventloop`.
     readonly : bool, optional
         Whether the connection is read-only. Defaults to `False`.
+    pragmas : dict, optional
+        Additional ``PRAGMA`` settings to apply to the connection, mapping
+        pragma names to values, e.g. ``{"cache_size": -65536}``. These take
+        precedence over `DEFAULT_PRAGMAS`. For instance,
+        ``{"journal_mode": "WAL", "synchronous": "NORMAL"}`` lets modules read
+        while another is writing, and spares a sync on every commit, which is
+        only safe from corruption in WAL mode.
     kwargs
         Remaining keyword arguments are passed to `aiosqlite.connect`.
 
@@ -772,6 +845,11 @@ async def create_connection(
     -------
     Connection
         A connection object for the requested database.
+
+    Raises
+    ------
+    ValueError
+        A pragma name or value isn't a plain word or integer.
     """
     if not isinstance(database, Path):
         database = Path(database)
@@ -794,7 +872,14 @@ async def create_connection(
     conn.setName(module.identifier)
     conn.row_factory = sqlite3.Row
     await conn.execute("PRAGMA foreign_keys = ON")
-    await conn.create_function("REGEXP", 2, regexp)
+    for name, value in (DEFAULT_PRAGMAS | (pragmas or {})).items():
+        # Pragma values can't be bound as parameters, so don't let anything
+        # but a single token through.
+        if not (PRAGMA_TOKEN.fullmatch(name) and PRAGMA_TOKEN.fullmatch(str(value))):
+            await conn.close()
+            raise ValueError(f"Invalid PRAGMA setting: {name} = {value!r}")
+        await conn.execute(f"PRAGMA {name} = {value}")
+    await conn.create_function("REGEXP", 2, regexp, deterministic=True)
     # HACK: As of aiosqlite v0.19, this method is not exposed by the library
     await conn._execute(conn._conn.create_collation, "FOLD", collate_casefold)
     conn._connection._module = module
@@ -834,7 +919,7 @@ def create_interactive_connection(database: str, **kwargs) -> sqlite3.Connection
     )
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
-    conn.create_function("REGEXP", 2, regexp)
+    conn.create_function("REGEXP", 2, regexp, deterministic=True)
     conn.create_collation("FOLD", collate_casefold)
     return conn
 
@@ -229,7 +229,7 @@ def _resize_phrase_deques():
         new_len = CFG["PhraseCooldown"]
         if new_len == recent_phrases[table].maxlen:
             break
-        recent_phrases[table] = deque(recent_phrases[table].copy(), maxlen=new_len)
+        recent_phrases[table] = deque(recent_phrases[table], maxlen=new_len)
 
 
 async def module_on_config_reloaded(ctx, name):
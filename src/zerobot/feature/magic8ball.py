@@ -204,7 +204,7 @@ def _resize_phrase_deques():
         new_len = CFG.get("PhraseCooldown", DEFAULT_COOLDOWN)
         if new_len == recent_phrases[name].maxlen:
             break
-        recent_phrases[name] = deque(recent_phrases[name].copy(), maxlen=new_len)
+        recent_phrases[name] = deque(recent_phrases[name], maxlen=new_len)
 
 
 async def module_on_config_reloaded(ctx, name):
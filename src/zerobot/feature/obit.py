@@ -204,7 +204,7 @@ def _resize_part_deques():
         new_len = CFG.get("PartCooldown", DEFAULT_COOLDOWN)
         if new_len == recent_parts[name].maxlen:
             break
-        recent_parts[name] = deque(recent_parts[name].copy(), maxlen=new_len)
+        recent_parts[name] = deque(recent_parts[name], maxlen=new_len)
 
 
 async def fetch_part(otype: ObitPart) -> sqlite3.Row | None:
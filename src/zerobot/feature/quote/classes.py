@@ -5,15 +5,23 @@ Classes/Models used by the Quote feature.
 
 from __future__ import annotations
 
+import itertools
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from enum import IntEnum, unique
 from typing import TYPE_CHECKING
 
-from zerobot.database import Connection, DBModel, Participant
+from zerobot.database import Connection, DBModel, DBUser, Participant
 
 if TYPE_CHECKING:
+    from collections import deque
+    from collections.abc import Iterable
     from sqlite3 import Row
 
+    from aiosqlite import Cursor
+
 
 @unique
 class QuoteStyle(IntEnum):
@@ -22,6 +30,183 @@ class QuoteStyle(IntEnum):
     Unstyled = 3
 
 
+@dataclass
+class Cooldown:
+    """The IDs of recently recited quotes.
+
+    The `queue` handles eviction of the oldest IDs, while `ids` mirrors its
+    contents for constant-time membership tests.
+    """
+
+    queue: deque
+    ids: set[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.ids = set(self.queue)
+
+    def __contains__(self, quote_id: int) -> bool:
+        return quote_id in self.ids
+
+    def append(self, quote_id: int):
+        """Put `quote_id` on cooldown, evicting the oldest ID if full."""
+        queue = self.queue
+        if queue.maxlen == 0:
+            return
+        if len(queue) == queue.maxlen:
+            self.ids.discard(queue[0])
+        queue.append(quote_id)
+        self.ids.add(quote_id)
+
+
+async def data_version(conn: Connection) -> tuple[int, int]:
+    """Get a token that changes whenever the database does.
+
+    ``PRAGMA data_version`` changes whenever another connection commits, while
+    `total_changes` counts the rows changed through `conn` itself.
+    """
+    async with conn.execute("PRAGMA data_version") as cur:
+        return (await cur.fetchone())[0], conn.total_changes
+
+
+class StatsCache:
+    """The results of statistics queries, kept until the database changes.
+
+    The statistics views aggregate over every quote, so it's well worth
+    reusing their results until something is written to the database, whether
+    through the querying connection or any other. The current year is also
+    considered, as some statistics depend on it.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of results to hold before starting over. Defaults
+        to 256.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._cache: dict[tuple[str, tuple], list[Row]] = {}
+        self._version = None
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def fetch(self, conn: Connection, sql: str, params: tuple = ()) -> list[Row]:
+        """Fetch the rows of a statistics query, reusing an earlier result."""
+        version = (*await data_version(conn), datetime.now(tz=timezone.utc).year)
+        if version != self._version or len(self._cache) >= self.maxsize:
+            self._cache.clear()
+            self._version = version
+        key = (sql, params)
+        if (rows := self._cache.get(key)) is None:
+            async with conn.execute(sql, params) as cur:
+                rows = self._cache[key] = await cur.fetchall()
+        return rows
+
+    def clear(self):
+        """Drop all cached results."""
+        self._cache.clear()
+        self._version = None
+
+
+def participant_from_row(conn: Connection, row: Row) -> Participant:
+    """Construct a `Participant` and its linked `DBUser` from a joined row.
+
+    The row is expected to have the ``participant_id`` and ``participant_name``
+    columns, along with every ``users`` column, as selected by
+    `Quote._lines_sql`.
+    """
+    user = DBUser.from_row(conn, row) if row["user_id"] is not None else None
+    return Participant(conn, row["participant_id"], row["participant_name"], user_id=row["user_id"], user=user)
+
+
+class ParticipantCache:
+    """A bounded LRU cache of `Participant` objects, keyed by ID.
+
+    Quote submitters and authors are a small, frequently recurring set of
+    participants, so most lookups can skip the database entirely. Cached
+    participants are only trusted until the database changes; see `validate`.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of participants to hold. Defaults to 1024.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._cache: OrderedDict[int, Participant] = OrderedDict()
+        self._version = None
+
+    def __contains__(self, participant_id: int) -> bool:
+        return participant_id in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get(self, conn: Connection, participant_id: int) -> Participant | None:
+        """Get a participant by ID, fetching it from the database on a miss.
+
+        Returns `None` if there is no participant with the given ID.
+        """
+        try:
+            participant = self._cache[participant_id]
+        except KeyError:
+            if (participant := await Participant.from_id(conn, participant_id)) is not None:
+                self.put(participant)
+        else:
+            self._cache.move_to_end(participant_id)
+        return participant
+
+    async def load(self, conn: Connection, participant_ids: Iterable[int]):
+        """Make sure the given participants are cached.
+
+        Any that aren't already cached are fetched together in a single query,
+        rather than one at a time by `get`.
+        """
+        missing = [pid for pid in set(participant_ids) if pid not in self._cache]
+        if not missing:
+            return
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                SELECT participant_id, {Participant.table_name}.name AS "participant_name",
+                       {DBUser.table_name}.*
+                FROM {Participant.table_name}
+                LEFT JOIN {DBUser.table_name} USING (user_id)
+                WHERE participant_id IN (SELECT value FROM json_each(?))
+            """,
+                (json.dumps(missing),),
+            )
+            for row in await cur.fetchall():
+                self.put(participant_from_row(conn, row))
+
+    def put(self, participant: Participant):
+        """Add or refresh the cached copy of `participant`."""
+        self._cache[participant.id] = participant
+        self._cache.move_to_end(participant.id)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def validate(self, conn: Connection):
+        """Drop all cached participants if the database has changed.
+
+        A participant may have been renamed or linked to a user since it was
+        cached, whether through `conn` or any other connection.
+        """
+        if (version := await data_version(conn)) != self._version:
+            self._cache.clear()
+            self._version = version
+
+    def clear(self):
+        """Drop all cached participants."""
+        self._cache.clear()
+        self._version = None
+
+
+participant_cache = ParticipantCache()
+
+
 class QuoteLine(DBModel):
     """A single—possibly the only—line of a quote.
 
@@ -47,6 +232,8 @@ class QuoteLine(DBModel):
         than something written or spoken. Defaults to `False`.
     """
 
+    __slots__ = ("action", "author", "author_num", "body", "line_num", "quote", "quote_id")
+
     table_name = "quote_lines"
 
     def __init__(
@@ -73,7 +260,7 @@ class QuoteLine(DBModel):
         self.quote = quote
 
     def __repr__(self):
-        attrs = ["quote_id", "line_num", "body", "author", "author_num", "action"]
+        attrs = ("quote_id", "line_num", "body", "author", "author_num", "action")
         repr_str = " ".join(f"{a}={getattr(self, a)!r}" for a in attrs)
         return f"<{self.__class__.__name__} {repr_str}>"
 
@@ -83,7 +270,7 @@ class QuoteLine(DBModel):
         return f"<{self.author}> {self.body}"
 
     @classmethod
-    async def from_row(cls, conn: Connection, row: Row) -> QuoteLine:
+    async def from_row(cls, conn: Connection, row: Row, author: Participant | None = None) -> QuoteLine:
         """Construct a `QuoteLine` from a database row.
 
         Parameters
@@ -92,12 +279,30 @@ class QuoteLine(DBModel):
             The database connection to use.
         row: sqlite3.Row
             A row returned from the database.
+        author : Participant, optional
+            The author of this line. If omitted, it is fetched from the
+            database by the row's ``participant_id``.
         """
         attrs = {name: row[name] for name in ("quote_id", "line_num", "author_num", "action")}
-        author = await Participant.from_id(conn, row["participant_id"])
+        if author is None:
+            author = await participant_cache.get(conn, row["participant_id"])
         return cls(conn, body=row["line"], author=author, **attrs)
 
 
+# Kept constant so that sqlite3 reuses the same prepared statement every save.
+# Unchanged lines are left alone, so they don't needlessly fire any triggers.
+SAVE_LINE_SQL = f"""
+    INSERT INTO {QuoteLine.table_name} VALUES(?, ?, ?, ?, ?, ?)
+    ON CONFLICT (quote_id, line_num) DO UPDATE SET
+        line = excluded.line,
+        participant_id = excluded.participant_id,
+        author_num = excluded.author_num,
+        action = excluded.action
+    WHERE (line, participant_id, author_num, action)
+        IS NOT (excluded.line, excluded.participant_id, excluded.author_num, excluded.action)
+"""
+
+
 class Quote(DBModel):
     """A ZeroBot quote.
 
@@ -119,7 +324,22 @@ class Quote(DBModel):
     id
     """
 
+    __slots__ = (
+        "_author_nums",
+        "_next_author_num",
+        "_str_cache",
+        "authors",
+        "date",
+        "id",
+        "lines",
+        "style",
+        "submitter",
+    )
+
     table_name = "quotes"
+    # Whether quote text is indexed in ``quote_fts``, which depends on what the
+    # SQLite library supports. Set by the Quote feature when it registers.
+    fts_enabled = False
 
     def __init__(
         self,
@@ -137,13 +357,24 @@ class Quote(DBModel):
         self.style = style
         self.lines = []
         self.authors = []
+        self._author_nums = {}  # Participant -> author_num
+        self._next_author_num = 1
+        self._str_cache = None
 
     def __repr__(self):
-        attrs = ["id", "submitter", "date", "style", "lines"]
+        attrs = ("id", "submitter", "date", "style", "lines")
         repr_str = " ".join(f"{a}={getattr(self, a)!r}" for a in attrs)
         return f"<{self.__class__.__name__} {repr_str}>"
 
     def __str__(self):
+        # Cached per style; the lines only change via add_line or fetch_lines,
+        # both of which clear the cache.
+        if self._str_cache is None or self._str_cache[0] is not self.style:
+            self._str_cache = (self.style, self._format())
+        return self._str_cache[1]
+
+    def _format(self) -> str:
+        """Format the quote according to its style."""
         if self.style is QuoteStyle.Standard:
             return "\n".join(str(line) for line in self.lines)
         if self.style is QuoteStyle.Epigraph:
@@ -166,49 +397,110 @@ class Quote(DBModel):
         row : sqlite3.Row
             A row returned from the database.
         """
-        submitter = await Participant.from_id(conn, row["submitter"])
-        quote = cls(
+        await participant_cache.validate(conn)
+        quote = await cls._from_row_without_lines(conn, row)
+        await quote.fetch_lines()
+        return quote
+
+    @classmethod
+    async def from_rows(cls, conn: Connection, rows: Iterable[Row]) -> list[Quote]:
+        """Construct a `Quote` from each of the given database rows.
+
+        Like `from_row`, but the lines of every quote are fetched together in
+        a single query rather than one query per quote.
+
+        Parameters
+        ----------
+        conn : Connection
+            The database connection to use.
+        rows : Iterable[sqlite3.Row]
+            Rows returned from the database.
+        """
+        rows = list(rows)
+        await participant_cache.validate(conn)
+        await participant_cache.load(conn, (row["submitter"] for row in rows))
+        quotes = {}
+        for row in rows:
+            quotes[row["quote_id"]] = await cls._from_row_without_lines(conn, row)
+        if not quotes:
+            return []
+        async with conn.cursor() as cur:
+            await cur.execute(
+                cls._lines_sql("quote_id IN (SELECT value FROM json_each(?))"),
+                (json.dumps(list(quotes)),),
+            )
+            rows = await cur.fetchall()
+        authors = {}
+        for quote_id, quote_rows in itertools.groupby(rows, key=lambda row: row["quote_id"]):
+            await quotes[quote_id]._set_lines(quote_rows, authors)
+        return list(quotes.values())
+
+    @classmethod
+    async def _from_row_without_lines(cls, conn: Connection, row: Row) -> Quote:
+        """Construct a `Quote` from a database row, leaving its lines empty."""
+        submitter = await participant_cache.get(conn, row["submitter"])
+        return cls(
             conn,
             quote_id=row["quote_id"],
             submitter=submitter,
             date=row["submission_date"],
             style=QuoteStyle(row["style"]),
         )
-        await quote.fetch_lines()
-        return quote
+
+    @staticmethod
+    def _lines_sql(condition: str) -> str:
+        """Return a query for the lines matching `condition`.
+
+        Each line's author and linked user are fetched along with the line
+        itself, rather than looking them up separately for every line.
+        """
+        return f"""
+            SELECT lines.*, authors.name AS "participant_name", users.*
+            FROM {QuoteLine.table_name} AS "lines"
+            JOIN {Participant.table_name} AS "authors" USING (participant_id)
+            LEFT JOIN {DBUser.table_name} AS "users" USING (user_id)
+            WHERE {condition}
+            ORDER BY quote_id, line_num
+        """
 
     async def fetch_lines(self) -> list[QuoteLine]:
         """Fetch the `QuoteLine`s that make up the quote body.
 
-        Sets `self.lines` to the fetched lines and returns them.
+        Sets `self.lines` to the fetched lines and `self.authors` to their
+        authors, then returns the lines.
         """
         async with self._connection.cursor() as cur:
-            await cur.execute(
-                f"""
-                SELECT * FROM {QuoteLine.table_name} WHERE quote_id = ?
-                ORDER BY line_num
-            """,
-                (self.id,),
-            )
-            self.lines = [await QuoteLine.from_row(self._connection, row) for row in await cur.fetchall()]
+            await cur.execute(self._lines_sql("quote_id = ?"), (self.id,))
+            await self._set_lines(await cur.fetchall(), {})
         return self.lines
 
+    async def _set_lines(self, rows: Iterable[Row], authors: dict[int, Participant]):
+        """Set the lines of this quote from rows returned by `_lines_sql`.
+
+        Authors are reused from and added to `authors`, keyed by their ID.
+        """
+        conn = self._connection
+        lines = []
+        for row in rows:
+            if (author := authors.get(row["participant_id"])) is None:
+                author = authors[row["participant_id"]] = participant_from_row(conn, row)
+            lines.append(await QuoteLine.from_row(conn, row, author))
+        self.lines = lines
+        self._str_cache = None
+        self._author_nums = {line.author: line.author_num for line in lines}
+        self._next_author_num = max(self._author_nums.values(), default=0) + 1
+        self.authors = sorted(self._author_nums, key=self._author_nums.__getitem__)
+
     async def fetch_authors(self) -> list[Participant]:
         """Fetch the authors that are part of this quote.
 
-        Authors in the list are ordered by their `author_num` value. Sets
-        `self.authors` to the fetched authors and returns them.
+        Authors in the list are ordered by their `author_num` value. The
+        authors are collected along with the lines, so this only needs to query
+        the database if the lines haven't been fetched yet. Returns
+        `self.authors`.
         """
-        async with self._connection.cursor() as cur:
-            await cur.execute(
-                f"""
-                SELECT DISTINCT participant_id FROM {QuoteLine.table_name}
-                WHERE quote_id = ?
-                ORDER BY author_num
-            """,
-                (self.id),
-            )
-            self.authors = [await Participant.from_id(self._connection, pid) for pid in await cur.fetchall()]
+        if not self.lines and self.id is not None:
+            await self.fetch_lines()
         return self.authors
 
     def get_author_num(self, author: Participant) -> int:
@@ -223,14 +515,7 @@ class Quote(DBModel):
         author : Participant
             The author to return an ordinal for.
         """
-        if not self.lines:
-            return 1
-        seen = set()
-        for line in self.lines:
-            if line.author == author:
-                return line.author_num
-            seen.add(line.author_num)
-        return max(seen) + 1
+        return self._author_nums.get(author, self._next_author_num)
 
     async def add_line(self, body: str, author: Participant, action: bool = False):
         """Add a line to this quote.
@@ -244,8 +529,13 @@ class Quote(DBModel):
         action : bool, optional
             Whether or not this line is an action. Defaults to `False`.
         """
+        self._str_cache = None
         line_num = len(self.lines) + 1
         author_num = self.get_author_num(author)
+        if author_num == self._next_author_num:
+            self._author_nums[author] = author_num
+            self._next_author_num += 1
+            self.authors.append(author)
         self.lines.append(
             QuoteLine(
                 self._connection,
@@ -260,31 +550,51 @@ class Quote(DBModel):
         )
 
     async def save(self):
-        """Save this `Quote` to the database."""
+        """Save this `Quote` to the database.
+
+        The quote and its lines are written in a single transaction, which is
+        rolled back if anything goes wrong.
+        """
         async with self._connection.cursor() as cur:
-            await cur.execute("BEGIN TRANSACTION")
-            await cur.execute(
-                f"""
-                INSERT INTO {self.table_name}
-                (quote_id, submitter, submission_date, style)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT (quote_id) DO UPDATE SET
-                    submitter = excluded.submitter,
-                    submission_date = excluded.submission_date,
-                    style = excluded.style
-            """,
-                (self.id, self.submitter.id, self.date, self.style.value),
-            )
+            await cur.execute("BEGIN IMMEDIATE TRANSACTION")
+            try:
+                await self._save(cur)
+            except BaseException:
+                await cur.execute("ROLLBACK TRANSACTION")
+                raise
+            await cur.execute("COMMIT TRANSACTION")
+
+    async def _save(self, cur: Cursor):
+        """Write the quote and its lines using `cur` within a transaction."""
+        await cur.execute(
+            f"""
+            INSERT INTO {self.table_name}
+            (quote_id, submitter, submission_date, style)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (quote_id) DO UPDATE SET
+                submitter = excluded.submitter,
+                submission_date = excluded.submission_date,
+                style = excluded.style
+        """,
+            (self.id, self.submitter.id, self.date, self.style.value),
+        )
 
+        # Only a new quote gets an ID, so lastrowid is reliable here
+        is_new = self.id is None
+        if is_new:
             self.id = cur.lastrowid
             for line in self.lines:
                 line.quote_id = self.id
 
-            await cur.execute(f"DELETE FROM {QuoteLine.table_name} WHERE quote_id = ?", (self.id,))
-            params = [(self.id, ql.line_num, ql.body, ql.author.id, ql.author_num, ql.action) for ql in self.lines]
-            await cur.executemany(f"INSERT INTO {QuoteLine.table_name} VALUES(?, ?, ?, ?, ?, ?)", params)
-
-            await cur.execute("COMMIT TRANSACTION")
+        await cur.executemany(
+            SAVE_LINE_SQL,
+            ((self.id, ql.line_num, ql.body, ql.author.id, ql.author_num, ql.action) for ql in self.lines),
+        )
+        if not is_new:
+            # Drop any lines left over from a longer version of the quote
+            await cur.execute(
+                f"DELETE FROM {QuoteLine.table_name} WHERE quote_id = ? AND line_num > ?", (self.id, len(self.lines))
+            )
 
     async def delete(self):
         """Remove this `Quote` from the database."""
@@ -9,6 +9,8 @@ from zerobot.command import CommandParser
 
 from .classes import QuoteStyle
 
+STYLE_CHOICES = tuple(style.name.lower() for style in QuoteStyle)
+
 
 def define_commands() -> list[CommandParser]:
     """Create our commands."""
@@ -31,7 +33,7 @@ def define_commands() -> list[CommandParser]:
     adding_options.add_argument(
         "-s",
         "--style",
-        choices=[style.name.lower() for style in QuoteStyle],
+        choices=STYLE_CHOICES,
         type=str.lower,
         default="standard",
         help=(
@@ -7,14 +7,17 @@ reporting quote database statistics.
 
 from __future__ import annotations
 
+import asyncio
 import contextlib
 import itertools
+import json
 import logging
 import re
+import sqlite3
 import textwrap
-from collections import deque
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
-from functools import partial
+from functools import lru_cache
 from importlib import resources
 from typing import TYPE_CHECKING, Any
 
@@ -23,12 +26,10 @@ from zerobot.database import Participant
 from zerobot.database import get_participant as getpart
 from zerobot.util import flatten, parse_iso_format
 
-from .classes import Quote, QuoteLine, QuoteStyle
+from .classes import Cooldown, Quote, QuoteLine, QuoteStyle, StatsCache, participant_cache
 from .commands import define_commands
 
 if TYPE_CHECKING:
-    import sqlite3
-
     from zerobot.context import Message
 
 MODULE_NAME = "Quote"
@@ -41,13 +42,21 @@ CORE = None
 CFG = None
 DB = None
 MOD_ID = __name__.rsplit(".", 2)[-2]
-get_participant = None
 
 logger = logging.getLogger("ZeroBot.Feature.Quote")
 
 MULTILINE_SEP = re.compile(r"(?:\n|\\n)\s*")
-MULTILINE_AUTHOR = re.compile(r"(?:<(.+)>|(.+):)")
-AUTHOR_PLACEHOLDER = re.compile(r"\\(\d+)")
+# Matches one line of a multi-line quote at a time, along with the author
+# prefix of every line but the first. The body runs up to the next separator
+# without any backtracking; its trailing whitespace is left to the caller, as
+# is stripping the whole string beforehand.
+MULTILINE_LINE = re.compile(
+    r"(?:\A\s*|(?:\n|\\n)\s*"
+    r"(?P<author>\\(?P<num>\d+)|<(?P<tag>\S+)>|(?P<name>\S+):|(?P<bare>\S+))(?!\S)[^\S\n]*)"
+    r"(?P<body>(?:[^\n\\]|\\(?!n))*)"
+)
+ACTION_PREFIX = re.compile(r"\\a *")
+STYLE_MAP = {style.name.lower(): style for style in QuoteStyle}
 WILDCARD_MAP = {
     ord("*"): "%",
     ord("?"): "_",
@@ -55,44 +64,115 @@ WILDCARD_MAP = {
     ord("_"): "\\_",
     ord("\\"): r"\\",
 }
+GLOB_MAP = {ord("["): "[[]"}
+RECENT_WRAPPER = textwrap.TextWrapper(width=160, max_lines=1, placeholder=" **[...]**")
+
+# The IDs on cooldown are bound as a single JSON array so that the statement
+# text never changes, letting SQLite reuse the compiled statement.
+COOLDOWN_FILTER = "quote_id NOT IN (SELECT value FROM json_each(?))"
+RANDOM_QUOTE_SQL = f"""
+    SELECT * FROM {Quote.table_name}
+    WHERE hidden = 0 AND {COOLDOWN_FILTER}
+    ORDER BY RANDOM() LIMIT 1
+"""
+# Picks a random ID and looks it up directly, avoiding a sort of the whole
+# table. Misses when the ID is deleted, hidden or on cooldown.
+RANDOM_QUOTE_ID_SQL = f"""
+    SELECT * FROM {Quote.table_name}
+    WHERE quote_id = (SELECT abs(random()) % max(quote_id) + 1 FROM {Quote.table_name})
+        AND hidden = 0 AND {COOLDOWN_FILTER}
+"""
+RANDOM_QUOTE_ID_TRIES = 5
+# Finds the quote whose lines, joined by newlines, are exactly the given text.
+# With the full-text index, LIKE narrows down the candidates without a scan,
+# though the lines themselves still decide the match.
+QUOTE_BODY_SCAN_SQL = f"""
+    SELECT quote_id FROM {QuoteLine.table_name}
+    GROUP BY quote_id
+    HAVING group_concat(line, char(10)) = ?1
+"""
+QUOTE_BODY_FTS_SQL = f"""
+    SELECT quote_id FROM {QuoteLine.table_name}
+    WHERE quote_id IN (SELECT rowid FROM quote_fts WHERE body LIKE ?1)
+    GROUP BY quote_id
+    HAVING group_concat(line, char(10)) = ?1
+"""
+# The first release with FTS5's trigram tokenizer
+FTS_MIN_SQLITE = (3, 34, 0)
+# Digit-only dates in ISO 8601's basic format: YYYYMMDD, and also YYYY and
+# YYYYMM for dateutil's parser on Python 3.10
+BASIC_ISO_DATE_LENGTHS = (4, 6, 8)
+STATS_CRITERIA = ("quotes", "submissions", "self_submissions", "per_year", "percent")
+
+LAST_MESSAGES_SIZE = 1024
 
 recent_quotes = {}
-last_messages = {}
+last_messages = OrderedDict()  # (protocol, server, channel) -> Message, oldest first
+stats_cache = StatsCache()
 
 
 async def module_register(core):
     """Initialize module."""
-    global CORE, CFG, DB, recent_quotes, get_participant
+    global CORE, CFG, DB, recent_quotes
     CORE = core
 
     # TEMP: TODO: decide between monolithic modules.toml or per-feature config
     CFG = core.load_config("modules")[MODULE_NAME]
-    recent_quotes["global"] = deque(maxlen=CFG.get("Cooldown.Count", 0))
+    recent_quotes["global"] = Cooldown(deque(maxlen=CFG.get("Cooldown.Count", 0)))
     # TODO: per-author cooldowns
 
-    def cooldown() -> int:
-        if CFG.get("Cooldown.PerAuthor", False):
-            return CFG.get("Cooldown.CountPerAuthor", 0)
-        return CFG.get("Cooldown.Count", 0)
-
     DB = await core.database_connect(MOD_ID)
-    await DB.create_function("cooldown", 0, cooldown)
-    await DB.executescript(resources.files("zerobot").joinpath("sql/schema/quote.sql").read_text())
-    get_participant = partial(getpart, DB)
+    schema = resources.files("zerobot").joinpath("sql/schema")
+    await DB.executescript(schema.joinpath("quote.sql").read_text())
+    Quote.fts_enabled = await fts_available(DB)
+    if Quote.fts_enabled:
+        await DB.executescript(schema.joinpath("quote_fts.sql").read_text())
+    else:
+        logger.warning("SQLite lacks FTS5 or its trigram tokenizer; quote searches will scan every quote.")
 
     CORE.command_register(MOD_ID, *define_commands())
 
 
 async def module_unregister():
     """Prepare for shutdown."""
+    # Cached participants hold a reference to the connection being closed
+    participant_cache.clear()
+    stats_cache.clear()
+    # Have SQLite gather statistics for the quote indexes when it's worth it,
+    # based on the queries run over this connection.
+    await DB.execute("PRAGMA optimize")
     await CORE.database_disconnect(MOD_ID)
 
 
+async def fts_available(conn) -> bool:
+    """Whether SQLite can provide the full-text index of quote text."""
+    if sqlite3.sqlite_version_info < FTS_MIN_SQLITE:
+        return False
+    async with conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')") as cur:
+        return bool((await cur.fetchone())[0])
+
+
+async def get_participant(name: str) -> Participant:
+    """Get a `Participant` by name, creating it if it doesn't exist.
+
+    The participant is always read from the database, so its copy also
+    replaces any cached one that may have gone stale, e.g. from a rename or
+    a newly linked user.
+    """
+    participant = await getpart(DB, name)
+    participant_cache.put(participant)
+    return participant
+
+
 def _resize_quote_deque():
     new_len = CFG.get("Cooldown.Count", 30)
-    if new_len == recent_quotes["global"].maxlen:
+    old_queue = recent_quotes["global"].queue
+    if new_len == old_queue.maxlen:
+        return
+    if new_len == 0:
+        recent_quotes["global"] = Cooldown(deque(maxlen=0))
         return
-    recent_quotes["global"] = deque(recent_quotes["global"].copy(), maxlen=new_len)
+    recent_quotes["global"] = Cooldown(deque(old_queue, maxlen=new_len))
 
 
 async def module_on_config_reloaded(ctx, name):
@@ -112,11 +192,19 @@ async def module_on_message(ctx, message):
     # Don't keep track of ZeroBot's lines
     if ctx.user == message.source:
         return
-    if not message.content or message.content.isspace():
+    content = message.content
+    # Only walk the whole string if it could be entirely whitespace
+    if not content or (content[0].isspace() and content.isspace()):
         return
-    server = "__DM__" if not message.server else message.server.name
-    channel = message.destination
-    last_messages.setdefault(ctx.protocol, {}).setdefault(server, {})[channel.name] = message
+    server = message.server
+    server = "__DM__" if not server else server.name
+    channel = message.destination.name
+    key = (ctx.protocol, server, channel)
+    last_messages[key] = message
+    last_messages.move_to_end(key)
+    # Forget the least recently active channels
+    if len(last_messages) > LAST_MESSAGES_SIZE:
+        last_messages.popitem(last=False)
 
 
 async def module_on_join(ctx, channel, user):
@@ -126,24 +214,7 @@ async def module_on_join(ctx, channel, user):
 
 async def module_command_quote(ctx, parsed):
     """Handle `quote` command."""
-    if parsed.subcmd:
-        await globals()[f"quote_{parsed.subcmd}"](ctx, parsed)
-    else:
-        # Recite a random quote
-        quote = await get_random_quote()
-        if quote is None:
-            await ctx.reply_command_result("Uh, there are no quotes...", parsed, CmdResult.NotFound)
-            return
-        await ctx.module_message(quote, parsed.msg.destination)
-
-
-async def execute_opt_case(cursor, sql: str, params: tuple | None = None, *, case_sensitive: bool = False):
-    """Execute a query with optional case-sensitive ``LIKE`` operator."""
-    if case_sensitive:
-        await cursor.execute("PRAGMA case_sensitive_like = 1")
-    await cursor.execute(sql, params)
-    if case_sensitive:
-        await cursor.execute("PRAGMA case_sensitive_like = 0")
+    await SUBCMD_HANDLERS[parsed.subcmd](ctx, parsed)
 
 
 async def fetch_quote(
@@ -151,23 +222,21 @@ async def fetch_quote(
     params: tuple | None = None,
     *,
     cooldown: bool = True,
-    case_sensitive: bool = False,
 ) -> Quote | None:
     """Fetch a quote from the database, respecting cooldowns.
 
     The parameters are the same as in an `aiosqlite.Cursor.execute` call, which
     this coroutine wraps. All quote fetches should use this coroutine as
     a base, as it handles quote cooldowns and other necessary state.
+
+    When respecting cooldowns, the query is responsible for excluding the
+    quotes on cooldown, typically by including `COOLDOWN_FILTER` and binding
+    `cooldown_ids()` to it. The fetched quote is then put on cooldown.
     """
-    if cooldown and not all(token in sql for token in ("LIMIT", "cooldown()")):
-        raise ValueError("Query must include a LIMIT with 'cooldown()'")
     # TODO: per-author cooldowns
     async with DB.cursor() as cur:
-        await execute_opt_case(cur, sql, params, case_sensitive=case_sensitive)
+        await cur.execute(sql, params)
         row = await cur.fetchone()
-        if cooldown:
-            while row and row["quote_id"] in recent_quotes["global"]:
-                row = await cur.fetchone()
     if row is not None:
         quote = await Quote.from_row(DB, row)
         if cooldown:
@@ -177,15 +246,24 @@ async def fetch_quote(
     return quote
 
 
+def cooldown_ids() -> str:
+    """Return the IDs of the quotes on cooldown as a JSON array.
+
+    Meant to be bound to the parameter in `COOLDOWN_FILTER`.
+    """
+    return json.dumps(list(recent_quotes["global"].ids))
+
+
 async def get_random_quote() -> Quote | None:
     """Fetch a random quote from the database."""
-    return await fetch_quote(
-        f"""
-        SELECT * FROM {Quote.table_name}
-        WHERE hidden = 0
-        ORDER BY RANDOM() LIMIT cooldown() + 1
-    """
-    )
+    # Exclude quotes on cooldown up front so that only the winning row is sent
+    # back, rather than fetching and discarding rows until one is usable.
+    params = (cooldown_ids(),)
+    for _ in range(RANDOM_QUOTE_ID_TRIES):
+        if (quote := await fetch_quote(RANDOM_QUOTE_ID_SQL, params)) is not None:
+            return quote
+    # Too many misses; the table is likely sparse, so fall back to a full sort
+    return await fetch_quote(RANDOM_QUOTE_SQL, params)
 
 
 async def get_quote_by_id(quote_id: int) -> Quote | None:
@@ -195,8 +273,11 @@ async def get_quote_by_id(quote_id: int) -> Quote | None:
     """
     if quote_id < 0:
         async with DB.cursor() as cur:
-            await cur.execute(f"SELECT * FROM {Quote.table_name} ORDER BY quote_id DESC")
-            row = (await cur.fetchall())[-quote_id - 1]
+            await cur.execute(
+                f"SELECT * FROM {Quote.table_name} ORDER BY quote_id DESC LIMIT 1 OFFSET ?",
+                (-quote_id - 1,),
+            )
+            row = await cur.fetchone()
         if row is not None:
             quote = await Quote.from_row(DB, row)
         else:
@@ -216,6 +297,13 @@ def read_datestamp(datestamp: str) -> datetime | None:
     Expects an ISO 8601 formatted date/time string or a UNIX timestamp. Returns
     `None` if the string could not be converted.
     """
+    # Plain integers can only be timestamps, save for basic ISO dates, so skip
+    # the doomed ISO parse for them.
+    if datestamp.lstrip("-").isdigit() and len(datestamp) not in BASIC_ISO_DATE_LENGTHS:
+        try:
+            return datetime.fromtimestamp(int(datestamp), tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
     try:
         date = parse_iso_format(datestamp)
     except ValueError:
@@ -226,13 +314,50 @@ def read_datestamp(datestamp: str) -> datetime | None:
     return date
 
 
+def split_lines(body: str, authors: list[Participant], style: QuoteStyle) -> list[tuple[Participant, str]]:
+    r"""Split the body of a multi-line quote into its lines and their authors.
+
+    Lines are separated by newlines or a literal ``\n``. The first line
+    belongs to the first of `authors`; every other line begins with its author,
+    either as a placeholder like ``\2`` for the second of `authors`, or by
+    name as ``<name>``, ``name:`` or just ``name``. Unstyled quotes keep the
+    author as written at the start of the line, with placeholders filled in.
+
+    Returns a list of 2-tuples of (author, line). Raises `ValueError` if a line
+    names someone who isn't among `authors`.
+    """
+    authors_by_name = {a.name: a for a in reversed(authors)}
+    lines = []
+    # Without trailing whitespace, every separator is followed by a line,
+    # so a long run of blank lines can't make the pattern backtrack.
+    body = body.strip()
+    for match in MULTILINE_LINE.finditer(body):
+        line_body = match["body"].rstrip()
+        if match["author"] is None:
+            # Handle first line specially
+            line_author = authors[0]
+        elif match["num"]:
+            if not 1 <= (num := int(match["num"])) <= len(authors):
+                raise ValueError("Author placeholder out of range")
+            line_author = authors[num - 1]
+            if style is QuoteStyle.Unstyled:
+                line_body = f"{line_author.name} {line_body}"
+        else:
+            if (line_author := authors_by_name.get(match["tag"] or match["name"] or match["bare"])) is None:
+                raise ValueError("Unknown line author")
+            if style is QuoteStyle.Unstyled:
+                line_body = body[match.start("author") : match.end("body")].rstrip()
+        lines.append((line_author, line_body))
+    return lines
+
+
 def handle_action_line(line: str, msg: Message) -> tuple[bool, str]:
     """Handles action checking and line modification for ``quote add``.
 
     Returns a 2-tuple of (is_action, strip_action).
     """
     action = False
-    if match := re.match(r"\\a *", line):
+    if match := ACTION_PREFIX.match(line):
         action = True
         line = line[match.end() :]
     elif msg.is_action_str(line):
@@ -241,9 +366,18 @@ def handle_action_line(line: str, msg: Message) -> tuple[bool, str]:
     return action, line
 
 
+@lru_cache(maxsize=256)
 def prepare_pattern(pattern: str, *, case_sensitive: bool = False, basic: bool = False) -> str:
-    """Prepare a pattern from a command for use in a query."""
-    if basic:
+    """Prepare a pattern from a command for use in a query.
+
+    The pattern is meant to be used with the operator given by
+    `match_operator` for the same options.
+    """
+    if basic and case_sensitive:
+        # GLOB is already case-sensitive and shares our wildcards
+        pattern = (pattern or "*").translate(GLOB_MAP)
+        pattern = f"*{pattern}*" if pattern != "*" else "*"
+    elif basic:
         pattern = (pattern or "*").translate(WILDCARD_MAP)
         pattern = f"%{pattern}%" if pattern != "%" else "%"
     else:
@@ -254,6 +388,188 @@ def prepare_pattern(pattern: str, *, case_sensitive: bool = False, basic: bool =
     return pattern
 
 
+def match_operator(*, case_sensitive: bool = False, basic: bool = False) -> str:
+    """Return the SQL operator that matches a pattern from `prepare_pattern`."""
+    if not basic:
+        return "REGEXP"
+    return "GLOB" if case_sensitive else "LIKE"
+
+
+def match_sql(operand: str, operator: str) -> str:
+    """Return SQL matching `operand` against a ``?`` pattern with `operator`."""
+    if operator == "LIKE":
+        # `prepare_pattern` escapes literal wildcards with a backslash
+        return f"{operand} LIKE ? ESCAPE '\\'"
+    return f"{operand} {operator} ?"
+
+
+@lru_cache(maxsize=64)
+def recent_sql(operator: str | None, *, submitter: bool = False) -> str:
+    """Build the query used by ``quote recent``.
+
+    The query filters on author names (or submitter names, if `submitter` is
+    true) using the given match `operator`, or not at all if it's `None`.
+    Its parameters are the pattern, if filtering, followed by the limit.
+    """
+    if operator is None:
+        # Nothing to filter on, so read straight off the submission date index
+        return f"""
+            SELECT quote_id, submitter, submission_date, style
+            FROM {Quote.table_name}
+            ORDER BY submission_date DESC LIMIT ?
+        """
+    if submitter:
+        condition = "submitter IN matched"
+    else:
+        condition = f"""EXISTS (
+            SELECT 1 FROM {QuoteLine.table_name}
+            WHERE {QuoteLine.table_name}.quote_id = {Quote.table_name}.quote_id
+                AND participant_id IN matched
+        )"""
+    # Walk the quotes newest first and stop as soon as enough match, rather
+    # than ranking every line of every quote.
+    return f"""
+        WITH matched AS (
+            SELECT participant_id
+            FROM participants_all_names
+            GROUP BY participant_id
+            HAVING {match_sql("group_concat(name, char(10))", operator)}
+        )
+        SELECT quote_id, submitter, submission_date, style
+        FROM {Quote.table_name}
+        WHERE {condition}
+        ORDER BY submission_date DESC LIMIT ?
+    """
+
+
+@lru_cache(maxsize=64)
+def search_sql(operator: str, *, line: bool, fts: bool, author: bool, submitter: bool, count: bool) -> str:
+    """Build the query used by ``quote search``.
+
+    Only the criteria that were actually given are filtered on; an omitted one
+    would otherwise be matched against a catch-all pattern for every row. The
+    query's parameters are the line pattern (twice, if `fts` is true), author
+    pattern and submitter pattern, for those that are included, followed by
+    `cooldown_ids()` unless `count` is true.
+    """
+    matched_names = f"""
+        SELECT participant_id
+        FROM participants_all_names
+        GROUP BY participant_id
+        HAVING {match_sql("group_concat(name, char(10))", operator)}
+    """
+    conditions = ["hidden = 0"]
+    if fts:
+        # FTS5 can't use its index for LIKE with an ESCAPE clause, so this is
+        # only meant for patterns without any escapes.
+        conditions.append(f"quote_id IN (SELECT rowid FROM quote_fts WHERE body {operator} ?)")
+    # The line and author patterns must match the same line, so they share
+    # one subquery, which stops at the first line that satisfies both.
+    line_conditions = []
+    if line:
+        line_conditions.append(match_sql("line", operator))
+    if author:
+        line_conditions.append(f"participant_id IN ({matched_names})")
+    if line_conditions:
+        conditions.append(f"""EXISTS (
+            SELECT 1 FROM {QuoteLine.table_name}
+            WHERE {QuoteLine.table_name}.quote_id = {Quote.table_name}.quote_id
+                AND {" AND ".join(line_conditions)}
+        )""")
+    if submitter:
+        conditions.append(f"submitter IN ({matched_names})")
+    if count:
+        # Let SQLite do the counting; there's nothing to pick at random
+        selection, order = "COUNT(*)", ""
+    else:
+        selection = "quote_id, submitter, submission_date, style"
+        order = f"AND {COOLDOWN_FILTER} ORDER BY RANDOM() LIMIT 1"
+    return f"""
+        SELECT {selection}
+        FROM {Quote.table_name}
+        WHERE {" AND ".join(conditions)}
+        {order}
+    """
+
+
+@lru_cache(maxsize=128)
+def stats_columns(selection: tuple[bool, ...], *, user: bool) -> str:
+    """Build the column list for ``quote stats``.
+
+    `selection` holds a flag for each of `STATS_CRITERIA`, in order. The
+    columns come from ``quote_stats_user`` if `user` is true, otherwise from
+    ``quote_stats_global``.
+    """
+    # This logic is a bit ugly, but I don't have a better idea at the moment.
+    if user:
+        submissions = "Number of Submissions"
+        year = itertools.compress(
+            ("Quotes this Year", "Avg. Yearly Quotes", "Submissions this Year", "Avg. Yearly Subs"),
+            flatten([[selection[0]] * 2, [selection[1]] * 2]),
+        )
+        percents = ("Quote %", "Submission %", "Self-Sub %")
+    else:
+        submissions = "Number of Submitters"
+        year = ("Quotes this Year", "Avg. Yearly Quotes")
+        percents = ("Self-Sub %",)
+    criteria = (
+        "Number of Quotes",
+        submissions,
+        "Self-Submissions",
+        tuple(year),
+        tuple(itertools.compress(percents, selection[:-2])),
+    )
+    return ", ".join(f'"{x}"' for x in flatten(itertools.compress(criteria, selection)))
+
+
+@lru_cache(maxsize=64)
+def leaderboard_sql(columns: str, order: str, *, around: bool) -> str:
+    """Build the query used by ``quote stats --leaderboard``.
+
+    The leaderboard is ranked by the `order` clause and shows the given
+    `columns`. Its parameters are the number of users to show, or, if
+    `around` is true, a name pattern followed by how many users to show on
+    either side of the matching one.
+    """
+    if not around:
+        return f"""
+            WITH ranked AS (
+                SELECT *, row_number() OVER (
+                    ORDER BY {order}
+                ) AS "Rank"
+                FROM quote_leaderboard
+            )
+            SELECT Rank, Name, {columns}
+            FROM ranked
+            ORDER BY {order}
+            LIMIT ?
+        """
+    return f"""
+        WITH participant_names AS (
+            SELECT participant_id,
+                   group_concat(name, char(10)) AS "name_list"
+            FROM participants_all_names
+            GROUP BY participant_id
+        ),
+        pivot AS (
+            SELECT *, count() FILTER (WHERE name_list REGEXP ?1) OVER (
+                ORDER BY {order}
+                ROWS BETWEEN ?2 PRECEDING AND ?2 FOLLOWING
+            ) AS "included",
+            row_number() OVER (
+                ORDER BY {order}
+            ) AS "Rank"
+            FROM quote_leaderboard
+            JOIN {Participant.table_name} USING (name)
+            JOIN participant_names USING (participant_id)
+        )
+        SELECT Rank, Name, {columns}
+        FROM pivot
+        WHERE included = 1
+        ORDER BY {order}
+    """
+
+
 def generate_table(rows: list[sqlite3.Row], target: tuple[int, Any] | None = None) -> list[str]:
     """Generate a Markdown-like table out of the given rows.
 
@@ -266,27 +582,17 @@ def generate_table(rows: list[sqlite3.Row], target: tuple[int, Any] | None = Non
     # TODO: factor out into function
     lines = []
     headers = rows[0].keys()
-    widths = [[len(str(col)) for col in row] for row in rows]
-    min_widths = [max(x) for x in zip(*widths, strict=True)]
-    line, rule = "", ""
-    for i, col in enumerate(headers):
-        # Create header
-        line += f"| {col:^{min_widths[i]}} "
-        min_width = max(len(col), min_widths[i])
-        rule += f"|{'-' * (min_width + 2)}"
-    lines.append(f"{line}|")
-    lines.append(f"{rule}|")
+    widths = [max(len(header), *(len(str(row[i])) for row in rows)) for i, header in enumerate(headers)]
+    names = " | ".join(f"{name:^{width}}" for name, width in zip(headers, widths, strict=True))
+    rule = "|".join("-" * (width + 2) for width in widths)
+    lines.append(f"| {names} |")
+    lines.append(f"|{rule}|")
     for row in rows:
-        line = ""
-        is_target = target is not None and row[target[0]] == target[1]
-        for i, col in enumerate(row):
-            min_width = max(len(headers[i]), min_widths[i])
-            if i == 0 and is_target:
-                col = f"* {col}"
-                line += f"| {col:>{min_width}} "
-            else:
-                line += f"| {col:{min_width}} "
-        lines.append(f"{line}|")
+        cells = [f"{col:{width}}" for col, width in zip(row, widths, strict=True)]
+        if target is not None and row[target[0]] == target[1]:
+            marked = f"* {row[0]}"
+            cells[0] = f"{marked:>{widths[0]}}"
+        lines.append(f"| {' | '.join(cells)} |")
     return lines
 
 
@@ -296,25 +602,26 @@ async def quote_exists(content: str | list[str]) -> bool:
         content = "\n".join(content)
     async with DB.cursor() as cur:
         await cur.execute(
-            f"""
-            SELECT EXISTS (
-                SELECT group_concat(line, char(10)) AS "body"
-                FROM {QuoteLine.table_name}
-                GROUP BY quote_id
-                HAVING body = ?
-            )
-        """,
-            (content,),
+            f"SELECT EXISTS ({QUOTE_BODY_FTS_SQL if Quote.fts_enabled else QUOTE_BODY_SCAN_SQL})", (content,)
         )
         return bool((await cur.fetchone())[0])
 
 
+async def quote_recite(ctx, parsed):
+    """Recite a random quote."""
+    quote = await get_random_quote()
+    if quote is None:
+        await ctx.reply_command_result("Uh, there are no quotes...", parsed, CmdResult.NotFound)
+        return
+    await ctx.module_message(quote, parsed.msg.destination)
+
+
 # TODO: This interface kinda sucks; redesign it.
 # TODO: Support non-MultiLine protocols
 async def quote_add(ctx, parsed):
     """Add a quote to the database."""
     submitter = await get_participant(parsed.args["submitter"] or parsed.invoker.name)
-    style = getattr(QuoteStyle, parsed.args["style"].title())
+    style = STYLE_MAP[parsed.args["style"]]
     if parsed.args["date"]:
         if (date := read_datestamp(parsed.args["date"])) is None:
             await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadSyntax)
@@ -327,29 +634,18 @@ async def quote_add(ctx, parsed):
 
     if parsed.args["multi"]:
         extra = parsed.args["extra_authors"] or []
-        authors = [author] + [await get_participant(a) for a in extra]
-        lines = MULTILINE_SEP.split(body)
-        first = True
-        for line in lines:
-            line = line.strip()
-            if first:
-                # Handle first line specially
-                line_author, line_body = author, line
-                first = False
-            else:
-                # Successive lines; extract line authors
-                line_author, line_body = line.split(maxsplit=1)
-                if match := AUTHOR_PLACEHOLDER.match(line_author):
-                    line_author = authors[int(match[1]) - 1]
-                    if style is QuoteStyle.Unstyled:
-                        line_body = AUTHOR_PLACEHOLDER.sub(line_author, line)
-                else:
-                    if match := MULTILINE_AUTHOR.match(line_author):
-                        line_author = match[1] or match[2]
-                    line_author = next(a for a in authors if a.name == line_author)
-                    if style is QuoteStyle.Unstyled:
-                        line_body = line
-            action, line_body = handle_action_line(line_body, parsed.msg)
+        # Look up each distinct name once, but keep every position so that
+        # author placeholders still line up with the given names.
+        unique = list(dict.fromkeys(extra))
+        found = dict(zip(unique, await asyncio.gather(*map(get_participant, unique)), strict=True))
+        authors = [author, *(found[name] for name in extra)]
+        try:
+            lines = split_lines(body, authors, style)
+        except ValueError:
+            await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadSyntax)
+            return
+        for line_author, text in lines:
+            action, line_body = handle_action_line(text, parsed.msg)
             await quote.add_line(line_body, line_author, action)
     else:
         action, body = handle_action_line(body, parsed.msg)
@@ -378,19 +674,12 @@ async def quote_del(ctx, parsed):
     if parsed.args["id"]:
         quote = await get_quote_by_id(int(body))
     else:
-        lines = MULTILINE_SEP.split(body)
         quote = await fetch_quote(
             f"""
-            WITH target AS (
-                SELECT quote_id, group_concat(line, char(10)) AS "body"
-                FROM {QuoteLine.table_name}
-                GROUP BY quote_id
-                HAVING body = ?
-            )
             SELECT * FROM {Quote.table_name}
-            WHERE quote_id = (SELECT quote_id FROM target)
+            WHERE quote_id = ({QUOTE_BODY_FTS_SQL if Quote.fts_enabled else QUOTE_BODY_SCAN_SQL})
         """,
-            ("\n".join(lines),),
+            (MULTILINE_SEP.sub("\n", body),),
             cooldown=False,
         )
     if quote is None:
@@ -410,43 +699,17 @@ async def quote_recent(ctx, parsed):
     if count < 1:
         await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadSyntax)
         return
-    if pattern:
-        target = "submitters" if parsed.args["submitter"] else "authors"
-        search_method = "LIKE" if basic else "REGEXP"
-        where = f"WHERE {target}.name_list {search_method} ?"
+    if not pattern:
+        query = (recent_sql(None), (count,))
     else:
-        where = ""
-    sql = f"""
-        WITH participant_names AS (
-            SELECT participant_id,
-                   group_concat(name, char(10)) AS "name_list"
-            FROM participants_all_names
-            GROUP BY participant_id
-        )
-        SELECT quote_id, submitter, submission_date, style
-        FROM (
-            SELECT *, row_number() OVER (PARTITION BY quote_id) AS "seqnum"
-            FROM {Quote.table_name}
-            JOIN {QuoteLine.table_name} USING (quote_id)
-            JOIN participant_names AS "authors" USING (participant_id)
-            JOIN participant_names AS "submitters"
-                ON submitter = submitters.participant_id
-            {where}
-        )
-        WHERE seqnum = 1  -- Don't include multiple lines from the same quote
-        ORDER BY submission_date DESC LIMIT ?
-    """
-    if pattern:
+        search_method = match_operator(basic=basic, case_sensitive=case_sensitive)
         pattern = prepare_pattern(pattern, basic=basic, case_sensitive=case_sensitive)
-        query = (sql, (pattern, count))
-    else:
-        query = (sql, (count,))
+        query = (recent_sql(search_method, submitter=parsed.args["submitter"]), (pattern, count))
     async with DB.cursor() as cur:
-        await execute_opt_case(cur, *query, case_sensitive=case_sensitive)
-        quotes = [await Quote.from_row(DB, row) for row in await cur.fetchall()]
+        await cur.execute(*query)
+        quotes = await Quote.from_rows(DB, await cur.fetchall())
     if count > 1:
-        wrapper = textwrap.TextWrapper(width=160, max_lines=1, placeholder=" **[...]**")
-        results = [f"**[{n}]** {wrapper.fill(str(quote))}" for n, quote in enumerate(quotes, 1)]
+        results = [f"**[{n}]** {RECENT_WRAPPER.fill(str(quote))}" for n, quote in enumerate(quotes, 1)]
     else:
         results = [str(quotes[0])]
     await ctx.reply_command_result(results, parsed)
@@ -463,43 +726,34 @@ async def quote_search(ctx, parsed):
     if parsed.args["id"]:
         result = await get_quote_by_id(parsed.args["id"])
     else:
-        selection = "COUNT(*)" if parsed.args["count"] else "quote_id, submitter, submission_date, style"
-        sql = f"""
-            WITH participant_names AS (
-                SELECT participant_id,
-                       group_concat(name, char(10)) AS "name_list"
-                FROM participants_all_names
-                GROUP BY participant_id
-            )
-            SELECT {selection}
-            FROM (
-                SELECT *, row_number() OVER (PARTITION BY quote_id) AS "seqnum"
-                FROM {Quote.table_name}
-                JOIN {QuoteLine.table_name} USING (quote_id)
-                JOIN participant_names AS "authors" USING (participant_id)
-                JOIN participant_names AS "submitters"
-                    ON submitter = submitters.participant_id
-        """
-        pattern = prepare_pattern(" ".join(parsed.args["pattern"] or []), basic=basic, case_sensitive=case_sensitive)
-        author_pat = prepare_pattern(parsed.args["author"], basic=basic, case_sensitive=case_sensitive)
-        submitter_pat = prepare_pattern(parsed.args["submitter"], basic=basic, case_sensitive=case_sensitive)
-        search_method = "LIKE" if basic else "REGEXP"
-        sql += f"""
-                WHERE hidden = 0 AND
-                      line {search_method} ? AND
-                      authors.name_list {search_method} ? AND
-                      submitters.name_list {search_method} ?
-            )
-            WHERE seqnum = 1  -- Don't include multiple lines from the same quote
-            ORDER BY RANDOM() LIMIT cooldown() + 1
-        """
-        query = (sql, (pattern, author_pat, submitter_pat))
+        pattern = " ".join(parsed.args["pattern"] or [])
+        author, submitter = parsed.args["author"], parsed.args["submitter"]
+        # The full-text index can narrow down basic searches, but can't help
+        # with regular expressions or escaped LIKE wildcards.
+        use_fts = (
+            Quote.fts_enabled
+            and bool(pattern)
+            and basic
+            and (case_sensitive or "\\" not in prepare_pattern(pattern, basic=True))
+        )
+        sql = search_sql(
+            match_operator(basic=basic, case_sensitive=case_sensitive),
+            line=bool(pattern),
+            fts=use_fts,
+            author=bool(author),
+            submitter=bool(submitter),
+            count=parsed.args["count"],
+        )
+        params = [pattern] * (1 + use_fts) if pattern else []
+        params += [name for name in (author, submitter) if name]
+        params = [prepare_pattern(pat, basic=basic, case_sensitive=case_sensitive) for pat in params]
+        query = (sql, params if parsed.args["count"] else (*params, cooldown_ids()))
         if parsed.args["count"]:
             async with DB.cursor() as cur:
-                await execute_opt_case(cur, *query, case_sensitive=case_sensitive)
+                await cur.execute(*query)
                 result = (await cur.fetchone())[0]
         else:
-            result = await fetch_quote(*query, case_sensitive=case_sensitive)
+            result = await fetch_quote(*query)
     criteria = "ID" if parsed.args["id"] else "pattern"
     if not result:
         await ctx.reply_command_result(f"Couldn't find any quotes matching that {criteria}", parsed, CmdResult.NotFound)
@@ -523,59 +777,39 @@ async def quote_stats(ctx, parsed):
         await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadSyntax)
         return
 
-    selection = [parsed.args[x] for x in ("quotes", "submissions", "self_submissions", "per_year", "percent")]
-    if selection[:-1] == [False] * 4:
+    selection = tuple(parsed.args[x] for x in STATS_CRITERIA)
+    if not any(selection[:-1]):
         # No criteria given, use defaults
-        selection = [True] * 5
-
-    # This logic is a bit ugly, but I don't have a better idea at the moment.
-    percents = []
-    criteria = {
-        "q": "Number of Quotes",
-        "u": "Number of Submitters",
-        "e": "Self-Submissions",
-        "y": ["Quotes this Year", "Avg. Yearly Quotes"],
-        "p": percents,
-    }
-    percent_names = ["Self-Sub %"]
-    if not parsed.args["global"]:
-        criteria["u"] = "Number of Submissions"
-        criteria["y"] += ["Submissions this Year", "Avg. Yearly Subs"]
-        percent_names = ["Quote %", "Submission %", "Self-Sub %"]
-        if selection[-2]:  # Show year stats
-            criteria["y"] = list(itertools.compress(criteria["y"], flatten([[selection[0]] * 2, [selection[1]] * 2])))
-    if selection[-1]:  # Show percentages
-        percents.extend(itertools.compress(percent_names, selection[:-2]))
-
-    chosen = flatten(itertools.compress(criteria.values(), selection))
-    chosen = ", ".join(f'"{x}"' for x in chosen)
+        selection = (True,) * len(STATS_CRITERIA)
+    chosen = stats_columns(selection, user=not parsed.args["global"])
 
     if parsed.args["global"]:
-        async with DB.cursor() as cur:
-            await cur.execute(f"SELECT {chosen} FROM quote_stats_global")
-            row = await cur.fetchone()
+        row = (await stats_cache.fetch(DB, f"SELECT {chosen} FROM quote_stats_global"))[0]
         result = ["**Database Stats**"]
         zipped = zip(row.keys(), row, strict=True)
     else:
         pattern = prepare_pattern(parsed.args["user"] or parsed.invoker.name)
-        async with DB.cursor() as cur:
-            await cur.execute(
-                f"""
-                WITH participant_names AS (
-                    SELECT participant_id,
-                           group_concat(name, char(10)) AS "name_list"
-                    FROM participants_all_names
-                    GROUP BY participant_id
-                )
-                SELECT stats.Name, {chosen}
-                FROM quote_stats_user AS "stats"
-                JOIN {Participant.table_name} USING (name)
-                JOIN participant_names AS "pn" USING (participant_id)
-                WHERE pn.name_list REGEXP ?
-            """,
-                (pattern,),
+        rows = await stats_cache.fetch(
+            DB,
+            f"""
+            WITH participant_names AS (
+                SELECT participant_id,
+                       group_concat(name, char(10)) AS "name_list"
+                FROM participants_all_names
+                GROUP BY participant_id
             )
-            row = await cur.fetchone()
+            SELECT stats.Name, {chosen}
+            FROM quote_stats_user AS "stats"
+            JOIN {Participant.table_name} USING (name)
+            JOIN participant_names AS "pn" USING (participant_id)
+            WHERE pn.name_list REGEXP ?
+        """,
+            (pattern,),
+        )
+        if not rows:
+            await ctx.reply_command_result("Couldn't find any stats for that user.", parsed, CmdResult.NotFound)
+            return
+        row = rows[0]
         result = [f"**Stats for {row['Name']}**"]
         zipped = zip(row.keys()[1:], row[1:], strict=True)
     result.append("```")
@@ -625,64 +859,37 @@ async def quote_stats_leaderboard(ctx, parsed, count):
 
     if parsed.args["global"]:
         # Show `count` top users
-        async with DB.cursor() as cur:
-            await cur.execute(
-                f"""
-                WITH ranked AS (
-                    SELECT *, row_number() OVER (
-                        ORDER BY {chosen_sort}
-                    ) AS "Rank"
-                    FROM quote_leaderboard
-                )
-                SELECT Rank, Name, {chosen}
-                FROM ranked
-                ORDER BY {chosen_sort}
-                LIMIT ?
-            """,
-                (count,),
-            )
-            rows = await cur.fetchall()
+        rows = await stats_cache.fetch(DB, leaderboard_sql(chosen, chosen_sort, around=False), (count,))
         table = "\n".join(generate_table(rows))
     else:
         # Show `count` users around target user
         pattern = prepare_pattern(parsed.args["user"] or parsed.invoker.name)
-        async with DB.cursor() as cur:
-            await cur.execute(
-                f"""
-                WITH participant_names AS (
-                    SELECT participant_id,
-                           group_concat(name, char(10)) AS "name_list"
-                    FROM participants_all_names
-                    GROUP BY participant_id
-                ),
-                pivot AS (
-                    SELECT *, count() FILTER (WHERE name_list REGEXP ?1) OVER (
-                        ORDER BY {chosen_sort}
-                        ROWS BETWEEN ?2 PRECEDING AND ?2 FOLLOWING
-                    ) AS "included",
-                    row_number() OVER (
-                        ORDER BY {chosen_sort}
-                    ) AS "Rank"
-                    FROM quote_leaderboard
-                    JOIN {Participant.table_name} USING (name)
-                    JOIN participant_names USING (participant_id)
-                )
-                SELECT Rank, Name, {chosen}
-                FROM pivot
-                WHERE included = 1
-                ORDER BY {chosen_sort}
-            """,
-                (pattern, parsed.args["count"]),
-            )
-            rows = await cur.fetchall()
+        rows = await stats_cache.fetch(
+            DB, leaderboard_sql(chosen, chosen_sort, around=True), (pattern, parsed.args["count"])
+        )
+        pattern = re.compile(pattern)
         for row in rows:
-            if re.match(pattern, row["Name"]):
+            if pattern.match(row["Name"]):
                 name = row["Name"]
                 break
         table = "\n".join(generate_table(rows, (1, name)))
     await ctx.module_message(f"```\n{table}\n```", parsed.msg.destination)
 
 
+async def find_message(msg_id, origin, server):
+    """Find the message with the given ID on `server`, or `None`.
+
+    The `origin` channel is searched first; the server's channels are only
+    listed if the message isn't there.
+    """
+    if (msg := await origin.get_message(msg_id)) is not None:
+        return msg
+    for channel in await server.channels():
+        if channel != origin and (msg := await channel.get_message(msg_id)) is not None:
+            return msg
+    return None
+
+
 async def quote_quick(ctx, parsed):
     """Shortcuts for adding a quote to the database."""
     lines = []
@@ -690,7 +897,7 @@ async def quote_quick(ctx, parsed):
     if (user := parsed.args["user"]) is not None:
         user = user.lstrip("@")
     submitter = await get_participant(parsed.args["submitter"] or parsed.invoker.name)
-    style = getattr(QuoteStyle, parsed.args["style"].title())
+    style = STYLE_MAP[parsed.args["style"]]
     if parsed.args["date"] and (date := read_datestamp(parsed.args["date"])) is None:
         await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadSyntax)
         return
@@ -699,22 +906,13 @@ async def quote_quick(ctx, parsed):
     if not parsed.args["id"] and not user:
         server = parsed.msg.server.name or "__DM__"
         channel = parsed.msg.destination.name
-        try:
-            msg = last_messages[ctx.protocol][server][channel]
-        except KeyError:
-            pass
-        else:
-            if msg is not None:
-                cached = True
+        msg = last_messages.get((ctx.protocol, server, channel))
+        cached = msg is not None
 
     if not cached:
-        channels = [parsed.msg.destination]  # Search origin channel first
-        channels.extend(c for c in (await parsed.server.channels()) if c != channels[0])
+        origin = parsed.msg.destination
         if parsed.args["id"]:
-            for channel in channels:
-                if (msg := await channel.get_message(parsed.args["id"])) is not None:
-                    break
-            else:  # No message found
+            if (msg := await find_message(parsed.args["id"], origin, parsed.server)) is None:
                 await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadTarget)
                 return
         elif user:
@@ -724,7 +922,7 @@ async def quote_quick(ctx, parsed):
                 await CORE.module_send_event("invalid_command", ctx, parsed.msg, CmdResult.BadTarget)
                 return
             limit = 100
-            msg = await anext(await channels[0].history(limit=limit, author=user))
+            msg = await anext(await origin.history(limit=limit, author=user))
             if not msg:
                 await ctx.reply_command_result(
                     f"Couldn't find a message from that user in the last {limit} messages.", parsed, CmdResult.NotFound
@@ -732,22 +930,33 @@ async def quote_quick(ctx, parsed):
                 return
         else:
             # Last message in channel
-            msg = [channel async for channel in channels[0].history(limit=2)][-1]
+            msg = [channel async for channel in origin.history(limit=2)][-1]
 
-    author = await get_participant(msg.author.name)
     if not parsed.args["date"]:
         date = msg.time
-    action, body = handle_action_line(msg.clean_content, msg)
-    lines.append((body, author, action))
-
     nprev = parsed.args["num_previous"]
-    async for prev_msg in msg.destination.history(limit=nprev, before=msg):
-        author = await get_participant(prev_msg.author.name)
-        action, body = handle_action_line(prev_msg.clean_content, prev_msg)
-        lines.append((body, author, action))
+    msgs = [msg, *[prev_msg async for prev_msg in msg.destination.history(limit=nprev, before=msg)]]
+    # Look up each distinct author once, concurrently
+    names = list(dict.fromkeys(m.author.name for m in msgs))
+    authors = dict(zip(names, await asyncio.gather(*map(get_participant, names)), strict=True))
+    for line_msg in msgs:
+        action, body = handle_action_line(line_msg.clean_content, line_msg)
+        lines.append((body, authors[line_msg.author.name], action))
 
     quote = Quote(DB, None, submitter, date=date, style=style)
     for line in reversed(lines):
         await quote.add_line(*line)
     await quote.save()
     await ctx.module_message(f"Okay, adding: {quote}", parsed.msg.destination)
+
+
+# Maps `parsed.subcmd` to its handler; `None` is a bare `quote` invocation.
+SUBCMD_HANDLERS = {
+    None: quote_recite,
+    "add": quote_add,
+    "del": quote_del,
+    "recent": quote_recent,
+    "search": quote_search,
+    "stats": quote_stats,
+    "quick": quote_quick,
+}
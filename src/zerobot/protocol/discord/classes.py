@@ -189,11 +189,13 @@ class DiscordMessage(zctx.Message, discord.Message):
     def content(self) -> str:
         return self._original.content
 
-    @property
+    # The wrappers below are built on first access and reused; a message's
+    # author, channel, and guild never change.
+    @cached_property
     def source(self) -> DiscordUser:
         return DiscordUser(self.context, self._original.author)
 
-    @property
+    @cached_property
     def destination(self) -> DiscordChannel:
         return DiscordChannel(self.context, self._original.channel)
 
@@ -201,7 +203,7 @@ class DiscordMessage(zctx.Message, discord.Message):
     def time(self) -> datetime.datetime:
         return self._original.created_at
 
-    @property
+    @cached_property
     def server(self) -> DiscordServer | None:
         if (guild := self._original.guild) is not None:
             return DiscordServer(self.context, guild)
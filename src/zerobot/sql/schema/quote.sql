@@ -25,6 +25,24 @@ CREATE TABLE IF NOT EXISTS quote_lines (
         ON UPDATE CASCADE
 ) WITHOUT ROWID;
 
+CREATE INDEX IF NOT EXISTS idx_quotes_submission_date
+ON quotes (submission_date);
+
+CREATE INDEX IF NOT EXISTS idx_quotes_submitter
+ON quotes (submitter);
+
+CREATE INDEX IF NOT EXISTS idx_quote_lines_participant_id
+ON quote_lines (participant_id);
+
+-- Triggers
+
+-- These keep quote_fts current, and are recreated along with it by
+-- quote_fts.sql. Without full-text support they would fail on every write, so
+-- start without them.
+DROP TRIGGER IF EXISTS tg_quote_fts_insert;
+DROP TRIGGER IF EXISTS tg_quote_fts_delete;
+DROP TRIGGER IF EXISTS tg_quote_fts_update;
+
 -- Views
 
 CREATE VIEW IF NOT EXISTS quote_leaderboard AS
@@ -0,0 +1,60 @@
+-- Full-text index of each quote's lines, joined by newlines. The trigram
+-- tokenizer lets SQLite use it for LIKE and GLOB substring searches. It needs
+-- FTS5 and SQLite 3.34+, so the Quote feature only sets it up when the library
+-- provides both.
+CREATE VIRTUAL TABLE IF NOT EXISTS quote_fts USING fts5(
+    body,
+    tokenize = 'trigram'
+);
+
+-- Bring the index in line with quote_lines, in case it was just created or
+-- quotes changed while its triggers weren't around. Only quotes whose text
+-- differs from their entry are reindexed.
+DELETE FROM quote_fts
+WHERE rowid NOT IN (SELECT quote_id FROM quote_lines)
+    OR body IS NOT (
+        SELECT group_concat(line, char(10))
+        FROM quote_lines
+        WHERE quote_id = quote_fts.rowid
+    );
+
+INSERT INTO quote_fts (rowid, body)
+SELECT quote_id, group_concat(line, char(10))
+FROM quote_lines
+WHERE quote_id NOT IN (SELECT rowid FROM quote_fts)
+GROUP BY quote_id;
+
+-- Triggers
+
+CREATE TRIGGER IF NOT EXISTS tg_quote_fts_insert
+AFTER INSERT ON quote_lines
+BEGIN
+    DELETE FROM quote_fts WHERE rowid = new.quote_id;
+    INSERT INTO quote_fts (rowid, body)
+    SELECT quote_id, group_concat(line, char(10))
+    FROM quote_lines
+    WHERE quote_id = new.quote_id
+    GROUP BY quote_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tg_quote_fts_delete
+AFTER DELETE ON quote_lines
+BEGIN
+    DELETE FROM quote_fts WHERE rowid = old.quote_id;
+    INSERT INTO quote_fts (rowid, body)
+    SELECT quote_id, group_concat(line, char(10))
+    FROM quote_lines
+    WHERE quote_id = old.quote_id
+    GROUP BY quote_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tg_quote_fts_update
+AFTER UPDATE OF quote_id, line ON quote_lines
+BEGIN
+    DELETE FROM quote_fts WHERE rowid IN (old.quote_id, new.quote_id);
+    INSERT INTO quote_fts (rowid, body)
+    SELECT quote_id, group_concat(line, char(10))
+    FROM quote_lines
+    WHERE quote_id IN (old.quote_id, new.quote_id)
+    GROUP BY quote_id;
+END;
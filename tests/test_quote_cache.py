@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from importlib import resources
+from types import SimpleNamespace
+
+import pytest
+
+from zerobot.database import Participant, create_connection, get_participant
+from zerobot.feature.quote import classes
+from zerobot.feature.quote.classes import ParticipantCache, StatsCache
+
+RANDOM_SQL = "SELECT random()"
+COUNT_SQL = "SELECT count(*) FROM t"
+MAXSIZE = 2
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Run a test coroutine with two connections to a fresh database."""
+
+    def run(test):
+        async def main():
+            path = tmp_path / "test.db"
+            conn = await create_connection(path, SimpleNamespace(identifier="test"))
+            other = await create_connection(path, SimpleNamespace(identifier="other"))
+            try:
+                await conn.executescript(resources.files("zerobot").joinpath("sql/schema/core.sql").read_text())
+                await conn.execute("CREATE TABLE t (x)")
+                await conn.commit()
+                await test(conn, other)
+            finally:
+                await conn.close()
+                await other.close()
+
+        asyncio.run(main())
+
+    return run
+
+
+def test_stats_reused(run):
+    async def test(conn, _):
+        cache = StatsCache()
+        first = await cache.fetch(conn, RANDOM_SQL)
+        assert await cache.fetch(conn, RANDOM_SQL) is first
+        assert len(cache) == 1
+
+    run(test)
+
+
+def test_stats_dropped_on_local_write(run):
+    async def test(conn, _):
+        cache = StatsCache()
+        assert (await cache.fetch(conn, COUNT_SQL))[0][0] == 0
+        await conn.execute("INSERT INTO t VALUES (1)")
+        assert (await cache.fetch(conn, COUNT_SQL))[0][0] == 1
+
+    run(test)
+
+
+def test_stats_dropped_on_other_commit(run):
+    async def test(conn, other):
+        cache = StatsCache()
+        assert (await cache.fetch(conn, COUNT_SQL))[0][0] == 0
+        await other.execute("INSERT INTO t VALUES (1)")
+        await other.commit()
+        assert (await cache.fetch(conn, COUNT_SQL))[0][0] == 1
+
+    run(test)
+
+
+def test_stats_dropped_on_new_year(run, monkeypatch):
+    class NextYear(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(datetime.now(tz).year + 1, 1, 1, tzinfo=tz)
+
+    async def test(conn, _):
+        cache = StatsCache()
+        first = await cache.fetch(conn, RANDOM_SQL)
+        monkeypatch.setattr(classes, "datetime", NextYear)
+        assert await cache.fetch(conn, RANDOM_SQL) != first
+
+    run(test)
+
+
+def test_stats_bounded(run):
+    async def test(conn, _):
+        cache = StatsCache(maxsize=MAXSIZE)
+        for n in range(MAXSIZE * 3):
+            assert (await cache.fetch(conn, "SELECT ?", (n,)))[0][0] == n
+            assert len(cache) <= MAXSIZE
+
+    run(test)
+
+
+def test_participants_bounded():
+    async def test():
+        cache = ParticipantCache(maxsize=MAXSIZE)
+        alice, bob, carol = (Participant(None, pid, name) for pid, name in enumerate(("alice", "bob", "carol"), 1))
+        cache.put(alice)
+        cache.put(bob)
+        # Using alice makes bob the least recently used
+        assert await cache.get(None, alice.id) is alice
+        cache.put(carol)
+        assert len(cache) == MAXSIZE
+        assert alice.id in cache
+        assert bob.id not in cache
+        assert carol.id in cache
+
+    asyncio.run(test())
+
+
+def test_participants_fetched_on_miss(run):
+    async def test(conn, _):
+        alice = await get_participant(conn, "alice")
+        bob = await get_participant(conn, "bob")
+        cache = ParticipantCache()
+        assert (await cache.get(conn, alice.id)).name == "alice"
+        assert await cache.get(conn, bob.id + 1) is None
+        cache.clear()
+        await cache.load(conn, [alice.id, bob.id, bob.id])
+        assert alice.id in cache
+        assert bob.id in cache
+
+    run(test)
+
+
+def test_participants_kept_without_changes(run):
+    async def test(conn, _):
+        alice = await get_participant(conn, "alice")
+        cache = ParticipantCache()
+        await cache.validate(conn)
+        cached = await cache.get(conn, alice.id)
+        await cache.validate(conn)
+        assert await cache.get(conn, alice.id) is cached
+
+    run(test)
+
+
+def test_participants_refreshed_on_local_write(run):
+    async def test(conn, _):
+        alice = await get_participant(conn, "alice")
+        cache = ParticipantCache()
+        await cache.validate(conn)
+        await cache.get(conn, alice.id)
+        await conn.execute("UPDATE participants SET name = 'alicia' WHERE participant_id = ?", (alice.id,))
+        await cache.validate(conn)
+        assert (await cache.get(conn, alice.id)).name == "alicia"
+
+    run(test)
+
+
+def test_participants_refreshed_on_other_commit(run):
+    async def test(conn, other):
+        alice = await get_participant(conn, "alice")
+        await conn.commit()
+        cache = ParticipantCache()
+        await cache.validate(conn)
+        await cache.get(conn, alice.id)
+        await other.execute("UPDATE participants SET name = 'alicia' WHERE participant_id = ?", (alice.id,))
+        await other.commit()
+        await cache.validate(conn)
+        assert (await cache.get(conn, alice.id)).name == "alicia"
+
+    run(test)
+
+
+def test_participants_loaded_with_users(run):
+    async def test(conn, _):
+        alice = await get_participant(conn, "alice")
+        bob = await get_participant(conn, "bob")
+        # A new user is linked to the participant of the same name
+        await conn.execute("""INSERT INTO users (name, creation_metadata) VALUES ('Alice', '{"via": "test"}')""")
+        cache = ParticipantCache()
+        await cache.load(conn, [alice.id, bob.id])
+        alice, bob = await cache.get(conn, alice.id), await cache.get(conn, bob.id)
+        assert alice.name == "alice"
+        assert alice.user.name == "Alice"
+        assert alice.user_id == alice.user.id
+        assert alice.user.creation_metadata == {"via": "test"}
+        assert bob.name == "bob"
+        assert bob.user is None
+
+    run(test)
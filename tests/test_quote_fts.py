@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import sqlite3
+from importlib import resources
+
+import pytest
+
+from zerobot.database import collate_casefold
+from zerobot.feature.quote.feature import FTS_MIN_SQLITE, QUOTE_BODY_FTS_SQL
+
+SCHEMA = resources.files("zerobot").joinpath("sql/schema")
+INDEXED_SQL = "SELECT rowid, body FROM quote_fts ORDER BY rowid"
+EXPECTED_SQL = """
+    SELECT quote_id, group_concat(line, char(10))
+    FROM quote_lines
+    GROUP BY quote_id
+    ORDER BY quote_id
+"""
+
+
+def fts_supported():
+    with sqlite3.connect(":memory:") as conn:
+        return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+
+pytestmark = pytest.mark.skipif(
+    sqlite3.sqlite_version_info < FTS_MIN_SQLITE or not fts_supported(), reason="SQLite lacks trigram FTS5"
+)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.create_collation("FOLD", collate_casefold)
+    conn.execute("PRAGMA foreign_keys = ON")
+    for script in ("core.sql", "quote.sql", "quote_fts.sql"):
+        conn.executescript(SCHEMA.joinpath(script).read_text())
+    conn.execute("INSERT INTO participants (participant_id, name) VALUES (0, 'nobody')")
+    for quote_id in (1, 2):
+        conn.execute("INSERT INTO quotes (quote_id) VALUES (?)", (quote_id,))
+        conn.executemany(
+            "INSERT INTO quote_lines (quote_id, line_num, line) VALUES (?, ?, ?)",
+            [(quote_id, n, f"quote {quote_id} line {n}") for n in (1, 2, 3)],
+        )
+    yield conn
+    conn.close()
+
+
+def assert_in_sync(conn):
+    assert conn.execute(INDEXED_SQL).fetchall() == conn.execute(EXPECTED_SQL).fetchall()
+
+
+def test_insert(conn):
+    assert_in_sync(conn)
+
+
+def test_update(conn):
+    conn.execute("UPDATE quote_lines SET line = 'edited' WHERE quote_id = 1 AND line_num = 2")
+    assert_in_sync(conn)
+
+
+def test_delete_lines(conn):
+    conn.execute("DELETE FROM quote_lines WHERE quote_id = 2 AND line_num > 1")
+    assert_in_sync(conn)
+
+
+def test_delete_quote_cascades(conn):
+    conn.execute("DELETE FROM quotes WHERE quote_id = 1")
+    assert_in_sync(conn)
+    assert conn.execute("SELECT rowid FROM quote_fts").fetchall() == [(2,)]
+
+
+def test_setup_repairs_drift(conn):
+    # Changes made while the triggers were missing, which leave the number of
+    # quotes as it was
+    conn.executescript(SCHEMA.joinpath("quote.sql").read_text())
+    conn.execute("UPDATE quote_lines SET line = 'edited' WHERE quote_id = 1 AND line_num = 2")
+    conn.execute("DELETE FROM quotes WHERE quote_id = 2")
+    conn.execute("INSERT INTO quotes (quote_id) VALUES (3)")
+    conn.execute("INSERT INTO quote_lines (quote_id, line) VALUES (3, 'new')")
+    conn.executescript(SCHEMA.joinpath("quote_fts.sql").read_text())
+    assert_in_sync(conn)
+
+
+def test_body_lookup(conn):
+    body = "quote 2 line 1\nquote 2 line 2\nquote 2 line 3"
+    assert conn.execute(QUOTE_BODY_FTS_SQL, (body,)).fetchall() == [(2,)]
+    assert conn.execute(QUOTE_BODY_FTS_SQL, (body.upper(),)).fetchall() == []
+    assert conn.execute(QUOTE_BODY_FTS_SQL, ("quote 2 line _",)).fetchall() == []
+
+
+def test_body_lookup_checks_lines(conn):
+    # The index only narrows down the candidates, so a stale entry can't match
+    conn.execute("UPDATE quote_fts SET body = 'gone' WHERE rowid = 1")
+    assert conn.execute(QUOTE_BODY_FTS_SQL, ("gone",)).fetchall() == []
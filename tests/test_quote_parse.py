@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import contextlib
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from zerobot.database import Participant
+from zerobot.feature.quote import feature
+from zerobot.feature.quote.classes import QuoteStyle
+from zerobot.feature.quote.feature import read_datestamp, split_lines
+
+ALICE = Participant(None, 1, "alice")
+BOB = Participant(None, 2, "bob")
+AUTHORS = [ALICE, BOB]
+
+
+def parse(body, style=QuoteStyle.Standard):
+    return [(author.name, line) for author, line in split_lines(body, AUTHORS, style)]
+
+
+@pytest.mark.parametrize("sep", ["\n", "\\n", " \\n  ", "\n\t"])
+def test_separators(sep):
+    assert parse(f"hello{sep}bob: hi") == [("alice", "hello"), ("bob", "hi")]
+
+
+def test_backslash_without_n_is_kept():
+    assert parse(r"C:\temp\2 is mine") == [("alice", r"C:\temp\2 is mine")]
+
+
+@pytest.mark.parametrize("prefix", ["<bob>", "bob:", "bob"])
+def test_author_forms(prefix):
+    assert parse(f"hello\\n{prefix} hi there") == [("alice", "hello"), ("bob", "hi there")]
+
+
+def test_placeholders():
+    assert parse("hello\\n\\2 hi\\n\\1 bye") == [("alice", "hello"), ("bob", "hi"), ("alice", "bye")]
+
+
+def test_repeated_name_is_first_author():
+    alias = Participant(None, 3, "alice")
+    lines = split_lines("hello\\nalice: again", [ALICE, alias], QuoteStyle.Standard)
+    assert lines[1][0] is ALICE
+
+
+def test_author_only_line():
+    assert parse("hello\\nbob:") == [("alice", "hello"), ("bob", "")]
+
+
+def test_glued_name_and_text():
+    # "bob:hi" is a single token, which isn't anyone's name
+    with pytest.raises(ValueError, match="Unknown"):
+        parse("hello\\nbob:hi")
+
+
+def test_unknown_name():
+    with pytest.raises(ValueError, match="Unknown"):
+        parse("hello\\ncarol: hi")
+
+
+@pytest.mark.parametrize("num", [0, 3, 99])
+def test_placeholder_out_of_range(num):
+    with pytest.raises(ValueError, match="out of range"):
+        parse(f"hello\\n\\{num} hi")
+
+
+def test_surrounding_whitespace():
+    assert parse("  hello  \\n  bob:   hi  \n\n") == [("alice", "hello"), ("bob", "hi")]
+
+
+def test_unstyled_rendering():
+    assert parse("hello\\n\\2 hi\\nbob: yo\\n<bob> sup\\nbob hey", QuoteStyle.Unstyled) == [
+        ("alice", "hello"),
+        ("bob", "bob hi"),
+        ("bob", "bob: yo"),
+        ("bob", "<bob> sup"),
+        ("bob", "bob hey"),
+    ]
+
+
+# The single-pass pattern used before lines were matched without backtracking
+REFERENCE_LINE = re.compile(
+    r"(?:\A\s*|(?:\n|\\n)\s*"
+    r"(?P<author>\\(?P<num>\d+)|<(?P<tag>\S+)>|(?P<name>\S+):|(?P<bare>\S+))(?!\S)\s*)"
+    r"(?P<body>.*?)\s*(?=\n|\\n|\Z)"
+)
+
+
+def reference_parse(body, style):
+    authors_by_name = {a.name: a for a in reversed(AUTHORS)}
+    lines = []
+    for match in REFERENCE_LINE.finditer(body):
+        line_body = match["body"]
+        if match["author"] is None:
+            line_author = AUTHORS[0]
+        elif match["num"]:
+            line_author = AUTHORS[int(match["num"]) - 1]
+            if style is QuoteStyle.Unstyled:
+                line_body = f"{line_author.name} {line_body}"
+        else:
+            line_author = authors_by_name[match["tag"] or match["name"] or match["bare"]]
+            if style is QuoteStyle.Unstyled:
+                line_body = body[match.start("author") : match.end("body")]
+        lines.append((line_author.name, line_body))
+    return lines
+
+
+def random_body(rng):
+    words = ["hi", "x:y", r"C:\temp", r"\a", "a\\b", "<3", "ok:"]
+    authors = ["alice", "bob", "<bob>", "<alice>", "bob:", "alice:", r"\1", r"\2"]
+
+    def text():
+        return " ".join(rng.choices(words, k=rng.randint(1, 4)))
+
+    body = text()
+    for _ in range(rng.randint(0, 4)):
+        sep = rng.choice(["\n", r"\n", r" \n ", "\n\t", r"\n  "])
+        body += sep + rng.choice(authors) + rng.choice([" ", "  ", "\t"]) + text()
+    return body
+
+
+@pytest.mark.parametrize("style", [QuoteStyle.Standard, QuoteStyle.Unstyled])
+def test_matches_reference(style):
+    rng = random.Random(style.value)
+    for _ in range(500):
+        body = random_body(rng)
+        assert parse(body, style) == reference_parse(body, style), body
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "a" + " " * 50_000 + "b",
+        "a\\nbob: x" + " \t" * 50_000 + "y",
+        "a" + "\\ " * 50_000,
+        "a" + "\\n" * 50_000 + "bob: b",
+        "a" + "\n " * 50_000 + "b",
+        "a\\nbob:" + " " * 50_000 + "\\n",
+    ],
+)
+def test_pathological_bodies(body):
+    start = time.perf_counter()
+    # Whether these parse is beside the point; only how long it takes matters
+    with contextlib.suppress(ValueError):
+        parse(body)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.parametrize(
+    ("datestamp", "expected"),
+    [
+        ("0", datetime(1970, 1, 1, tzinfo=timezone.utc)),
+        ("1700000000", datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)),
+        ("20231005", datetime(2023, 10, 5)),  # noqa: DTZ001
+        ("2023-10-05T12:30:00+00:00", datetime(2023, 10, 5, 12, 30, tzinfo=timezone.utc)),
+        ("yesterday", None),
+        ("9" * 30, None),
+    ],
+)
+def test_read_datestamp(datestamp, expected):
+    assert read_datestamp(datestamp) == expected
+
+
+@pytest.mark.parametrize("datestamp", ["2023", "202310", "20231005"])
+def test_read_datestamp_prefers_iso(datestamp, monkeypatch):
+    # dateutil's parser, used on Python 3.10, reads all of these as dates
+    iso_date = datetime(2023, 10, 5, tzinfo=timezone.utc)
+    monkeypatch.setattr(feature, "parse_iso_format", lambda _: iso_date)
+    assert read_datestamp(datestamp) is iso_date